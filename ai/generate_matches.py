@@ -5,6 +5,10 @@ Wavelength Match Matrix Generator
 This script fetches all users and their posts from Supabase,
 extracts interests using AI, and generates pairwise matches.
 
+Work is ranked by user activity and drained within an optional budget
+(see scheduler.py). Interests and pair check times are cached between runs,
+so anything skipped because the budget ran out is picked up next time.
+
 Usage:
     python generate_matches.py
 
@@ -12,12 +16,19 @@ Environment variables required:
     ANTHROPIC_API_KEY - Your Anthropic API key
     NEXT_PUBLIC_SUPABASE_URL - Your Supabase project URL
     SUPABASE_SERVICE_ROLE_KEY - Your Supabase service role key (for write access)
+
+Optional environment variables:
+    MATCH_BUDGET_CALLS - Max AI API calls per run (0 = unlimited)
+    MATCH_BUDGET_TOKENS - Max AI output tokens per run (0 = unlimited)
+    MATCH_BUDGET_SECONDS - Max wall time per run in seconds (0 = unlimited)
+    MATCH_STATE_PATH - Where to keep scheduler state (default: ai/.match_state.json);
+                       must persist between runs for carry-over to work
 """
 
 import os
 import sys
 import json
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 
 # Load environment variables from .env.local
@@ -36,44 +47,78 @@ if not all([SUPABASE_URL, SUPABASE_KEY, ANTHROPIC_KEY]):
 # Import after checking env vars
 from supabase import create_client, Client
 from interests import extract, match, calculate_match_score, generate_conversation_starter
+from scheduler import (
+    Budget, load_state, save_state, prune_state, record_extraction, pair_key,
+    plan_extractions, plan_refreshes, plan_pairs,
+    ACTIVITY_LOOKBACK_DAYS, EXTRACT_COST, MATCH_COST, STARTER_COST, PAIR_COST,
+)
 
 # Initialize Supabase client
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# PostgREST caps responses at 1000 rows by default
+PAGE_SIZE = 1000
+
+
+def fetch_all_rows(build_query) -> list:
+    """
+    Fetch every row of a query, paging past the PostgREST row limit.
+
+    Args:
+        build_query: Callable returning a fresh, ordered query builder
+
+    Returns:
+        List of all rows
+    """
+    rows = []
+    start = 0
+    while True:
+        page = build_query().range(start, start + PAGE_SIZE - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+        start += PAGE_SIZE
+
 
 def fetch_all_users_with_posts() -> list:
     """
     Fetch all users and their posts from Supabase.
 
     Returns:
-        List of dicts with 'id', 'username', and 'posts' keys
+        List of dicts with 'id', 'username', 'posts', 'created_at'
+        and 'last_post_at' keys
     """
-    print("\n[1/4] Fetching users and posts from Supabase...")
+    print("\n[1/5] Fetching users and posts from Supabase...")
 
-    # Fetch all profiles
-    profiles_response = supabase.table('profiles').select('id, username').execute()
-    profiles = profiles_response.data or []
+    # Fetch all profiles; this set also decides which state gets pruned,
+    # so it must not be truncated by the row limit
+    profiles = fetch_all_rows(lambda: supabase.table('profiles')
+                              .select('id, username, created_at')
+                              .order('id'))
 
     print(f"  Found {len(profiles)} users")
 
     users = []
     for profile in profiles:
         # Fetch user's widgets (posts)
-        widgets_response = supabase.table('widgets') \
-            .select('content, type') \
-            .eq('user_id', profile['id']) \
-            .neq('type', 'repost') \
-            .execute()
-
-        widgets = widgets_response.data or []
+        widgets = fetch_all_rows(lambda: supabase.table('widgets')
+                                 .select('content, type, created_at')
+                                 .eq('user_id', profile['id'])
+                                 .neq('type', 'repost')
+                                 .order('id'))
 
         # Extract text content from widgets
         posts = [w['content'] for w in widgets if w.get('content')]
 
+        # ISO timestamps in the same timezone sort chronologically as strings
+        post_times = [w['created_at'] for w in widgets if w.get('created_at')]
+
         users.append({
             'id': profile['id'],
             'username': profile.get('username', 'unknown'),
-            'posts': posts
+            'posts': posts,
+            'created_at': profile.get('created_at'),
+            'last_post_at': max(post_times) if post_times else None
         })
 
         if posts:
@@ -82,97 +127,217 @@ def fetch_all_users_with_posts() -> list:
     return users
 
 
-def extract_all_interests(users: list) -> list:
+def fetch_activity_signals(users: list) -> dict:
     """
-    Extract interests for all users using AI.
+    Fetch the signals the scheduler ranks work by.
+
+    Adds 'last_message_at' to each user and returns the last update time
+    of every existing match row.
+
+    Args:
+        users: List of user dicts with 'id' key
+
+    Returns:
+        Dict mapping pair_key() to user_matches.updated_at
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=ACTIVITY_LOOKBACK_DAYS)).isoformat()
+
+    messages = fetch_all_rows(lambda: supabase.table('messages')
+                              .select('sender_id, created_at')
+                              .gte('created_at', cutoff)
+                              .order('created_at', desc=True))
+
+    # Newest first, so the first row seen per sender is their latest message
+    last_message_at = {}
+    for message in messages:
+        last_message_at.setdefault(message['sender_id'], message['created_at'])
+
+    for user in users:
+        user['last_message_at'] = last_message_at.get(user['id'])
+
+    match_rows = fetch_all_rows(lambda: supabase.table('user_matches')
+                                .select('user1_id, user2_id, updated_at')
+                                .order('id'))
+
+    return {
+        pair_key(row['user1_id'], row['user2_id']): row['updated_at']
+        for row in match_rows
+    }
+
+
+def run_extractions(pending: list, state: dict, budget: Budget, now: str) -> int:
+    """
+    Extract interests for users in order until the budget is spent.
+
+    Args:
+        pending: Ranked list of user dicts with 'posts' key
+        state: Scheduler state from load_state(), updated in place
+        budget: Budget shared across the run
+        now: ISO timestamp of the run start
+
+    Returns:
+        Number of users deferred to the next run
+    """
+    deferred = 0
+    for user in pending:
+        if not budget.can_afford(EXTRACT_COST):
+            deferred += 1
+            continue
+
+        budget.charge(EXTRACT_COST)
+        try:
+            interests = extract(user['posts'], raise_errors=True)
+        except Exception as e:
+            # Leave the user pending so they are retried on the next run
+            print(f"  - {user['username']}: Error extracting interests: {e}")
+            continue
+
+        changed = record_extraction(state, user['id'], interests, now)
+        print(f"  - {user['username']}: {interests}{'' if changed else ' (unchanged)'}")
+
+    if deferred:
+        print(f"  Budget reached, deferred {deferred} users to the next run")
+
+    return deferred
+
+
+def extract_all_interests(users: list, state: dict, budget: Budget, now: str) -> list:
+    """
+    Extract interests for users using AI, most active users first.
+
+    Users whose cached interests are still current reuse them. Extraction
+    stops once the budget is spent; the remaining users keep their cached
+    interests (if any) and are retried on the next run.
 
     Args:
         users: List of user dicts with 'posts' key
+        state: Scheduler state from load_state(), updated in place
+        budget: Budget shared across the run
+        now: ISO timestamp of the run start
 
     Returns:
         Same list with 'interests' key added
     """
-    print("\n[2/4] Extracting interests using AI...")
+    print("\n[2/5] Extracting interests using AI...")
 
-    for i, user in enumerate(users):
+    pending = plan_extractions(users, state, datetime.fromisoformat(now))
+    print(f"  {len(pending)} users need extraction")
+    run_extractions(pending, state, budget, now)
+
+    for user in users:
         if not user['posts']:
             user['interests'] = []
-            print(f"  - {user['username']}: No posts, skipping")
             continue
-
-        interests = extract(user['posts'])
-        user['interests'] = interests
-        print(f"  - {user['username']}: {interests}")
+        user['interests'] = state['users'].get(user['id'], {}).get('interests', [])
 
     return users
 
 
-def generate_all_matches(users: list) -> list:
+def generate_all_matches(users: list, state: dict, match_rows: dict,
+                         budget: Budget, now: str) -> tuple:
     """
-    Generate pairwise matches between all users.
+    Generate pairwise matches for pairs that are due, most valuable first.
 
     Args:
         users: List of user dicts with 'interests' key
+        state: Scheduler state from load_state()
+        match_rows: Mapping of pair_key() to user_matches.updated_at
+        budget: Budget shared across the run
+        now: ISO timestamp of the run start
 
     Returns:
-        List of match dicts ready for database insertion
+        Tuple of (match dicts ready for database insertion,
+        pair_key()s checked this run that had no match)
     """
-    print("\n[3/4] Generating pairwise matches...")
+    print("\n[3/5] Generating pairwise matches...")
 
     matches = []
-    total_pairs = 0
+    unmatched = []
+    analyzed = 0
 
-    # Filter users with interests
     users_with_interests = [u for u in users if u.get('interests')]
     print(f"  {len(users_with_interests)} users have interests")
 
-    for i in range(len(users_with_interests)):
-        for j in range(i + 1, len(users_with_interests)):
-            total_pairs += 1
+    # Pairs come back with user1_id < user2_id for the database constraint
+    pending = plan_pairs(users, state, match_rows, datetime.fromisoformat(now))
+    print(f"  {len(pending)} pairs due for matching")
+
+    for user1, user2 in pending:
+        if not budget.can_afford(PAIR_COST):
+            break
+        analyzed += 1
 
-            user1 = users_with_interests[i]
-            user2 = users_with_interests[j]
+        # Generate match; on failure the pair stays due for the next run
+        budget.charge(MATCH_COST)
+        try:
+            shared = match(user1['interests'], user2['interests'], raise_errors=True)
+        except Exception as e:
+            print(f"  Error matching {user1['username']} <-> {user2['username']}: {e}")
+            continue
 
-            # Ensure user1_id < user2_id for database constraint
-            if user1['id'] > user2['id']:
-                user1, user2 = user2, user1
+        if not shared:
+            unmatched.append(pair_key(user1['id'], user2['id']))
+        else:
+            score = calculate_match_score(shared)
+            starter = generate_conversation_starter(shared)
+            budget.charge(STARTER_COST)
+
+            matches.append({
+                'user1_id': user1['id'],
+                'user2_id': user2['id'],
+                'shared_interests': shared,
+                'match_score': score,
+                'conversation_starter': starter
+            })
+
+            print(f"  Match: {user1['username']} <-> {user2['username']} (score: {score})")
+
+    print(f"\n  Total pairs analyzed: {analyzed}")
+    if analyzed < len(pending):
+        print(f"  Budget reached, deferred {len(pending) - analyzed} pairs to the next run")
+    print(f"  Matches found: {len(matches)}")
 
-            # Generate match
-            shared = match(user1['interests'], user2['interests'])
+    return matches, unmatched
 
-            if shared:
-                score = calculate_match_score(shared)
-                starter = generate_conversation_starter(shared)
 
-                matches.append({
-                    'user1_id': user1['id'],
-                    'user2_id': user2['id'],
-                    'shared_interests': shared,
-                    'match_score': score,
-                    'conversation_starter': starter
-                })
+def refresh_stale_interests(users: list, state: dict, budget: Budget, now: str) -> None:
+    """
+    Re-extract interests that are current but older than EXTRACT_MAX_AGE_DAYS.
 
-                print(f"  Match: {user1['username']} <-> {user2['username']} (score: {score})")
+    Runs after pair work so these refreshes only use leftover budget. If the
+    interests changed, the user's pairs become due on the next run.
 
-    print(f"\n  Total pairs analyzed: {total_pairs}")
-    print(f"  Matches found: {len(matches)}")
+    Args:
+        users: List of user dicts with 'posts' key
+        state: Scheduler state from load_state(), updated in place
+        budget: Budget shared across the run
+        now: ISO timestamp of the run start
+    """
+    print("\n[4/5] Refreshing old interests with leftover budget...")
 
-    return matches
+    pending = plan_refreshes(users, state, datetime.fromisoformat(now))
+    print(f"  {len(pending)} users due for a refresh")
+    run_extractions(pending, state, budget, now)
 
 
-def save_matches_to_supabase(matches: list) -> None:
+def save_matches_to_supabase(matches: list) -> list:
     """
     Save matches to the user_matches table in Supabase.
     Uses upsert to update existing matches.
 
     Args:
         matches: List of match dicts
+
+    Returns:
+        pair_key()s of the matches that were saved successfully
     """
-    print("\n[4/4] Saving matches to Supabase...")
+    print("\n[5/5] Saving matches to Supabase...")
 
     if not matches:
         print("  No matches to save")
-        return
+        return []
+
+    saved = []
 
     # Upsert matches (update if exists, insert if not)
     for match_data in matches:
@@ -181,11 +346,46 @@ def save_matches_to_supabase(matches: list) -> None:
                 match_data,
                 on_conflict='user1_id,user2_id'
             ).execute()
+            saved.append(pair_key(match_data['user1_id'], match_data['user2_id']))
             print(f"  Saved: {match_data['user1_id'][:8]}... <-> {match_data['user2_id'][:8]}...")
         except Exception as e:
             print(f"  Error saving match: {e}")
 
-    print(f"\n  Successfully saved {len(matches)} matches!")
+    print(f"\n  Successfully saved {len(saved)} of {len(matches)} matches!")
+
+    return saved
+
+
+def delete_matches_from_supabase(keys: list) -> list:
+    """
+    Delete user_matches rows for pairs that no longer share interests.
+
+    Args:
+        keys: pair_key()s of pairs whose recompute found no match
+
+    Returns:
+        pair_key()s whose rows were deleted successfully
+    """
+    if not keys:
+        return []
+
+    deleted = []
+    for key in keys:
+        user1_id, user2_id = key.split(':')
+        try:
+            supabase.table('user_matches') \
+                .delete() \
+                .eq('user1_id', user1_id) \
+                .eq('user2_id', user2_id) \
+                .execute()
+            deleted.append(key)
+            print(f"  Removed: {user1_id[:8]}... <-> {user2_id[:8]}...")
+        except Exception as e:
+            print(f"  Error removing match: {e}")
+
+    print(f"  Removed {len(deleted)} of {len(keys)} outdated matches")
+
+    return deleted
 
 
 def main():
@@ -195,6 +395,10 @@ def main():
     print(f"Started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print("=" * 60)
 
+    now = datetime.now(timezone.utc).isoformat()
+    budget = Budget()
+    state = load_state()
+
     # Step 1: Fetch users and posts
     users = fetch_all_users_with_posts()
 
@@ -202,14 +406,30 @@ def main():
         print("\nNo users found. Exiting.")
         return
 
+    match_rows = fetch_activity_signals(users)
+
     # Step 2: Extract interests
-    users = extract_all_interests(users)
+    users = extract_all_interests(users, state, budget, now)
 
     # Step 3: Generate matches
-    matches = generate_all_matches(users)
+    matches, unmatched = generate_all_matches(users, state, match_rows, budget, now)
+
+    # Step 4: Refresh old interests, only after due pairs have had the budget
+    refresh_stale_interests(users, state, budget, now)
+
+    # Step 5: Save to database
+    saved = save_matches_to_supabase(matches)
+
+    # Pairs that stopped matching lose their old row so it isn't shown as fresh
+    outdated = [key for key in unmatched if key in match_rows]
+    removed = delete_matches_from_supabase(outdated)
 
-    # Step 4: Save to database
-    save_matches_to_supabase(matches)
+    # Pairs whose match failed or whose row could not be written stay due
+    checked = [key for key in unmatched if key not in match_rows] + removed + saved
+    for key in checked:
+        state['pairs'][key] = now
+    prune_state(state, {u['id'] for u in users})
+    save_state(state)
 
     print("\n" + "=" * 60)
     print("Match matrix generation complete!")
@@ -219,6 +439,8 @@ def main():
     return {
         'users_processed': len(users),
         'matches_generated': len(matches),
+        'pairs_checked': len(checked),
+        'budget_used': budget.summary(),
         'timestamp': datetime.now().isoformat()
     }
 
@@ -87,7 +87,7 @@ def normalize_interest(interest: str) -> str:
     return INTEREST_NORMALIZATION_MAP.get(lower, lower)
 
 
-def extract(posts: list, max_interests: int = 10) -> list:
+def extract(posts: list, max_interests: int = 10, raise_errors: bool = False) -> list:
     """
     Extract semantic interests from a list of user posts using AI analysis.
 
@@ -101,6 +101,8 @@ def extract(posts: list, max_interests: int = 10) -> list:
     Args:
         posts: List of post content strings (text or image descriptions)
         max_interests: Maximum number of interests to return (default: 10)
+        raise_errors: Re-raise API/parsing errors instead of returning [],
+                      so callers can tell a failure from "no interests"
 
     Returns:
         List of normalized, canonical interest strings
@@ -168,11 +170,13 @@ Return ONLY the JSON array, no other text."""
         return normalized[:max_interests]
 
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"Error extracting interests: {e}")
         return []
 
 
-def match(list1: list, list2: list) -> dict:
+def match(list1: list, list2: list, raise_errors: bool = False) -> dict:
     """
     Find semantic matches between two interest lists using AI analysis.
 
@@ -185,6 +189,8 @@ def match(list1: list, list2: list) -> dict:
     Args:
         list1: First user's list of interests
         list2: Second user's list of interests
+        raise_errors: Re-raise API/parsing errors instead of returning {},
+                      so callers can tell a failure from "no matches"
 
     Returns:
         Dictionary mapping matched concepts to explanations
@@ -254,6 +260,8 @@ Return ONLY the JSON object, no other text."""
         return matches
 
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"Error matching interests: {e}")
         return {}
 
@@ -0,0 +1,401 @@
+"""
+Wavelength Recompute Scheduler
+
+This module decides which interest extractions and pairwise matches are worth
+spending the AI budget on during a run of generate_matches.py. Work items are
+ranked by how active the users involved are, then drained until the budget of
+API calls, tokens or wall time runs out. Anything left over stays stale in the
+state file and is picked up first on the next run.
+
+The state file (MATCH_STATE_PATH) is the only record of extracted interests
+and checked pairs, so it must persist between runs. If the job runs in a fresh
+checkout or container, point MATCH_STATE_PATH at a persistent volume;
+otherwise every run starts from scratch and re-extracts everything.
+
+Signals used for ranking:
+    - Recency of the user's latest widget (widgets.created_at)
+    - Recency of the user's latest sent message (messages.created_at)
+    - New-user status (profiles.created_at)
+    - Staleness of the existing match row (user_matches.updated_at)
+
+Functions:
+    activity_score(user: dict, now: datetime) -> float: Score how active a user is
+    plan_extractions(users: list, state: dict, now: datetime) -> list: Ranked extraction work
+    plan_refreshes(users: list, state: dict, now: datetime) -> list: Ranked age-only re-extractions
+    plan_pairs(users: list, state: dict, match_rows: dict, now: datetime) -> list: Ranked match work
+"""
+
+import os
+import json
+import re
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+# =============================================================================
+# CONFIGURATION
+# =============================================================================
+
+# Budget limits (0 = unlimited). Read from the environment so the nightly job
+# can be tuned without code changes.
+BUDGET_CALLS = int(os.getenv('MATCH_BUDGET_CALLS', '0'))
+BUDGET_TOKENS = int(os.getenv('MATCH_BUDGET_TOKENS', '0'))
+BUDGET_SECONDS = float(os.getenv('MATCH_BUDGET_SECONDS', '0'))
+
+# Where cached interests and pair check times are kept between runs
+STATE_PATH = os.getenv(
+    'MATCH_STATE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.match_state.json')
+)
+
+# Worst-case cost of each kind of work item, mirroring the max_tokens used by
+# the calls in interests.py. Tokens are output ceilings, not exact usage.
+EXTRACT_COST = {'calls': 1, 'tokens': 500}
+MATCH_COST = {'calls': 1, 'tokens': 800}
+STARTER_COST = {'calls': 1, 'tokens': 100}
+# A pair that matches costs both calls
+PAIR_COST = {key: MATCH_COST[key] + STARTER_COST[key] for key in MATCH_COST}
+
+# Activity decays by half every ACTIVITY_HALF_LIFE_DAYS
+ACTIVITY_HALF_LIFE_DAYS = 3.0
+NEW_USER_DAYS = 7
+NEW_USER_BONUS = 1.0
+MESSAGE_WEIGHT = 0.5
+
+# Only messages this recent are fetched; older ones contribute ~nothing anyway
+ACTIVITY_LOOKBACK_DAYS = 30
+
+# A pair not refreshed for this long is due again, even without new posts
+MATCH_STALE_DAYS = 14.0
+
+# Interests older than this are re-extracted, to pick up edited or deleted widgets
+EXTRACT_MAX_AGE_DAYS = 14.0
+
+
+# =============================================================================
+# BUDGET
+# =============================================================================
+
+class Budget:
+    """
+    Tracks API calls, tokens and wall time spent during a run.
+
+    A limit of 0 means that dimension is unlimited.
+    """
+
+    def __init__(self, calls: int = BUDGET_CALLS, tokens: int = BUDGET_TOKENS,
+                 seconds: float = BUDGET_SECONDS):
+        self.max_calls = calls
+        self.max_tokens = tokens
+        self.max_seconds = seconds
+        self.calls = 0
+        self.tokens = 0
+        self.started = time.monotonic()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def can_afford(self, cost: dict) -> bool:
+        """
+        Check whether a work item of the given worst-case cost still fits.
+
+        Args:
+            cost: Dict with 'calls' and 'tokens' keys
+
+        Returns:
+            True if the item can run without exceeding any limit
+        """
+        if self.max_calls and self.calls + cost['calls'] > self.max_calls:
+            return False
+        if self.max_tokens and self.tokens + cost['tokens'] > self.max_tokens:
+            return False
+        if self.max_seconds and self.elapsed() >= self.max_seconds:
+            return False
+        return True
+
+    def charge(self, cost: dict) -> None:
+        """Record the cost of a work item that was run."""
+        self.calls += cost['calls']
+        self.tokens += cost['tokens']
+
+    def summary(self) -> dict:
+        return {
+            'calls': self.calls,
+            'tokens': self.tokens,
+            'seconds': round(self.elapsed(), 1),
+        }
+
+
+# =============================================================================
+# STATE
+# =============================================================================
+
+def load_state(path: str = STATE_PATH) -> dict:
+    """
+    Load scheduler state from disk.
+
+    Returns:
+        Dict with structure:
+        {
+            "users": {user_id: {"interests": [...], "extracted_at": iso,
+                                "changed_at": iso}},
+            "pairs": {"user1_id:user2_id": iso}
+        }
+    """
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        state = {}
+    except (OSError, ValueError) as e:
+        print(f"  Could not read scheduler state ({e}), starting fresh")
+        state = {}
+
+    state.setdefault('users', {})
+    state.setdefault('pairs', {})
+    return state
+
+
+def save_state(state: dict, path: str = STATE_PATH) -> None:
+    """Write scheduler state to disk atomically."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def prune_state(state: dict, user_ids: set) -> None:
+    """
+    Drop state for users that no longer exist, in place.
+
+    Args:
+        state: Scheduler state from load_state()
+        user_ids: Ids of every current profile
+    """
+    state['users'] = {
+        user_id: cached for user_id, cached in state['users'].items()
+        if user_id in user_ids
+    }
+    state['pairs'] = {
+        key: checked_at for key, checked_at in state['pairs'].items()
+        if all(user_id in user_ids for user_id in key.split(':'))
+    }
+
+
+def record_extraction(state: dict, user_id: str, interests: list, now: str) -> bool:
+    """
+    Store freshly extracted interests for a user, in place.
+
+    'changed_at' only moves when the interests differ from the cached ones,
+    so a refresh that finds nothing new doesn't make the user's pairs due.
+
+    Returns:
+        True if the interests changed
+    """
+    cached = state['users'].get(user_id)
+    changed = cached is None or set(cached.get('interests', [])) != set(interests)
+
+    if changed:
+        changed_at = now
+    else:
+        changed_at = cached.get('changed_at') or cached.get('extracted_at') or now
+
+    state['users'][user_id] = {
+        'interests': interests,
+        'extracted_at': now,
+        'changed_at': changed_at,
+    }
+    return changed
+
+
+def pair_key(user1_id: str, user2_id: str) -> str:
+    """Build the state key for a pair, ordered the same way as user_matches."""
+    if user1_id > user2_id:
+        user1_id, user2_id = user2_id, user1_id
+    return f"{user1_id}:{user2_id}"
+
+
+# =============================================================================
+# SCORING
+# =============================================================================
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """
+    Parse a Supabase TIMESTAMPTZ string into an aware datetime.
+
+    Returns:
+        datetime in UTC, or None if the value is missing or malformed
+    """
+    if not value:
+        return None
+    # Postgres trims trailing zeros from fractional seconds, which
+    # fromisoformat() rejects before Python 3.11, so pad to microseconds
+    value = re.sub(r'\.(\d{1,6})\d*', lambda m: '.' + m.group(1).ljust(6, '0'),
+                   value.replace('Z', '+00:00'))
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def _age_days(value: Optional[str], now: datetime) -> Optional[float]:
+    parsed = parse_timestamp(value)
+    if parsed is None:
+        return None
+    return max(0.0, (now - parsed).total_seconds() / 86400)
+
+
+def _decay(age_days: Optional[float]) -> float:
+    if age_days is None:
+        return 0.0
+    return 0.5 ** (age_days / ACTIVITY_HALF_LIFE_DAYS)
+
+
+def activity_score(user: dict, now: datetime) -> float:
+    """
+    Score how recently active a user is.
+
+    Args:
+        user: User dict with optional 'last_post_at', 'last_message_at'
+              and 'created_at' timestamps
+        now: Reference time for the run
+
+    Returns:
+        Non-negative float; higher means more worth refreshing
+    """
+    score = _decay(_age_days(user.get('last_post_at'), now))
+    score += MESSAGE_WEIGHT * _decay(_age_days(user.get('last_message_at'), now))
+
+    joined_days = _age_days(user.get('created_at'), now)
+    if joined_days is not None and joined_days <= NEW_USER_DAYS:
+        score += NEW_USER_BONUS
+
+    return score
+
+
+def needs_extraction(user: dict, state: dict) -> bool:
+    """
+    Check whether a user's cached interests are missing or out of date.
+
+    Interests are out of date when the user has posted since they were
+    extracted.
+    """
+    cached = state['users'].get(user['id'])
+    if not cached:
+        return True
+
+    extracted_at = parse_timestamp(cached.get('extracted_at'))
+    last_post_at = parse_timestamp(user.get('last_post_at'))
+    if extracted_at is None:
+        return True
+    return last_post_at is not None and last_post_at > extracted_at
+
+
+def needs_refresh(user: dict, state: dict, now: datetime) -> bool:
+    """
+    Check whether current cached interests are old enough to re-extract.
+
+    Edits and deletions don't bump any timestamp, so age is the only way to
+    catch them. This is lower priority than needs_extraction().
+    """
+    if needs_extraction(user, state):
+        return False
+
+    extracted_at = parse_timestamp(state['users'][user['id']]['extracted_at'])
+    return (now - extracted_at).total_seconds() / 86400 > EXTRACT_MAX_AGE_DAYS
+
+
+def plan_extractions(users: list, state: dict, now: datetime) -> list:
+    """
+    Rank users whose interests are missing or predate their latest post.
+
+    Args:
+        users: List of user dicts with 'id', 'posts' and activity timestamps
+        state: Scheduler state from load_state()
+        now: Reference time for the run
+
+    Returns:
+        Users needing extraction, most valuable first
+    """
+    pending = [u for u in users if u['posts'] and needs_extraction(u, state)]
+    return sorted(pending, key=lambda u: activity_score(u, now), reverse=True)
+
+
+def plan_refreshes(users: list, state: dict, now: datetime) -> list:
+    """
+    Rank users whose interests are current but older than EXTRACT_MAX_AGE_DAYS.
+
+    These run after all due pair work, so they only use leftover budget.
+
+    Returns:
+        Users due for a refresh, most valuable first
+    """
+    pending = [u for u in users if u['posts'] and needs_refresh(u, state, now)]
+    return sorted(pending, key=lambda u: activity_score(u, now), reverse=True)
+
+
+def _changed_at(cached: dict) -> Optional[str]:
+    # State written before 'changed_at' existed only has 'extracted_at'
+    return cached.get('changed_at') or cached.get('extracted_at')
+
+
+def plan_pairs(users: list, state: dict, match_rows: dict, now: datetime) -> list:
+    """
+    Rank user pairs whose match needs to be (re-)computed.
+
+    A pair is due when it has never been checked, when either user's
+    interests changed after the pair was last checked, or when
+    neither its match row nor its last check is newer than MATCH_STALE_DAYS.
+
+    Args:
+        users: List of user dicts with 'id' and 'interests' keys
+        state: Scheduler state from load_state()
+        match_rows: Mapping of pair_key() to user_matches.updated_at
+        now: Reference time for the run
+
+    Returns:
+        List of (user1, user2) tuples with user1['id'] < user2['id'],
+        most valuable first
+    """
+    users_with_interests = [u for u in users if u.get('interests')]
+    activity = {u['id']: activity_score(u, now) for u in users_with_interests}
+
+    ranked = []
+    for i in range(len(users_with_interests)):
+        for j in range(i + 1, len(users_with_interests)):
+            user1 = users_with_interests[i]
+            user2 = users_with_interests[j]
+
+            if user1['id'] > user2['id']:
+                user1, user2 = user2, user1
+
+            key = pair_key(user1['id'], user2['id'])
+            checked_at = parse_timestamp(state['pairs'].get(key))
+
+            # A pair checked with no match keeps its old row, so take
+            # whichever of the row and the last check is more recent
+            ages = [age for age in (_age_days(match_rows.get(key), now),
+                                    _age_days(state['pairs'].get(key), now))
+                    if age is not None]
+            refresh_age = min(ages) if ages else None
+
+            if checked_at is not None and refresh_age <= MATCH_STALE_DAYS:
+                latest_change = max(
+                    parse_timestamp(_changed_at(state['users'].get(u['id'], {})))
+                    or checked_at
+                    for u in (user1, user2)
+                )
+                if latest_change <= checked_at:
+                    continue
+
+            # Older (or never refreshed) pairs are more urgent
+            staleness = 1.0 if refresh_age is None else min(1.0, refresh_age / MATCH_STALE_DAYS)
+
+            priority = activity[user1['id']] + activity[user2['id']] + staleness
+            ranked.append((priority, user1, user2))
+
+    ranked.sort(key=lambda item: item[0], reverse=True)
+    return [(user1, user2) for _, user1, user2 in ranked]
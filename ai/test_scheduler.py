@@ -0,0 +1,275 @@
+"""
+Tests for the Wavelength recompute scheduler.
+
+Run with:
+    python -m pytest ai/test_scheduler.py
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import scheduler
+from scheduler import (
+    Budget, needs_extraction, needs_refresh, pair_key, parse_timestamp,
+    plan_extractions, plan_pairs, plan_refreshes, prune_state, record_extraction,
+    EXTRACT_COST, MATCH_COST, PAIR_COST, STARTER_COST,
+)
+
+NOW = datetime(2026, 10, 19, 12, 0, tzinfo=timezone.utc)
+
+
+def days_ago(days: float) -> str:
+    return (NOW - timedelta(days=days)).isoformat()
+
+
+def make_state(user_ids, extracted_days=1.0, interests=None):
+    return {
+        'users': {
+            user_id: {
+                'interests': interests or ['music'],
+                'extracted_at': days_ago(extracted_days),
+                'changed_at': days_ago(extracted_days),
+            }
+            for user_id in user_ids
+        },
+        'pairs': {},
+    }
+
+
+def make_users(user_ids, **fields):
+    return [{'id': user_id, 'posts': ['post'], 'interests': ['music'], **fields}
+            for user_id in user_ids]
+
+
+def due_keys(users, state, match_rows=None):
+    return [pair_key(u1['id'], u2['id'])
+            for u1, u2 in plan_pairs(users, state, match_rows or {}, NOW)]
+
+
+# =============================================================================
+# parse_timestamp
+# =============================================================================
+
+@pytest.mark.parametrize('value, expected', [
+    ('2024-02-15T10:30:00+00:00', datetime(2024, 2, 15, 10, 30, tzinfo=timezone.utc)),
+    ('2024-02-15T10:30:00Z', datetime(2024, 2, 15, 10, 30, tzinfo=timezone.utc)),
+    ('2024-02-15T10:30:00.12345+00:00',
+     datetime(2024, 2, 15, 10, 30, 0, 123450, tzinfo=timezone.utc)),
+    ('2024-02-15T10:30:00', datetime(2024, 2, 15, 10, 30, tzinfo=timezone.utc)),
+])
+def test_parse_timestamp(value, expected):
+    assert parse_timestamp(value) == expected
+
+
+@pytest.mark.parametrize('value', [None, '', 'not a date'])
+def test_parse_timestamp_invalid(value):
+    assert parse_timestamp(value) is None
+
+
+# =============================================================================
+# Budget
+# =============================================================================
+
+def test_budget_unlimited_by_default():
+    budget = Budget(calls=0, tokens=0, seconds=0)
+    for _ in range(100):
+        budget.charge(PAIR_COST)
+    assert budget.can_afford(PAIR_COST)
+
+
+def test_budget_call_cutoff():
+    budget = Budget(calls=3, tokens=0, seconds=0)
+    assert budget.can_afford(PAIR_COST)
+    budget.charge(EXTRACT_COST)
+    budget.charge(EXTRACT_COST)
+    assert budget.can_afford(EXTRACT_COST)
+    assert not budget.can_afford(PAIR_COST)
+
+
+def test_budget_token_cutoff():
+    budget = Budget(calls=0, tokens=1000, seconds=0)
+    budget.charge(MATCH_COST)
+    assert budget.can_afford(STARTER_COST)
+    assert not budget.can_afford(EXTRACT_COST)
+
+
+def test_budget_time_cutoff(monkeypatch):
+    budget = Budget(calls=0, tokens=0, seconds=60)
+    monkeypatch.setattr(scheduler.time, 'monotonic', lambda: budget.started + 61)
+    assert not budget.can_afford(EXTRACT_COST)
+
+
+def test_pair_cost_is_sum_of_parts():
+    assert PAIR_COST == {'calls': MATCH_COST['calls'] + STARTER_COST['calls'],
+                         'tokens': MATCH_COST['tokens'] + STARTER_COST['tokens']}
+
+
+# =============================================================================
+# State
+# =============================================================================
+
+def test_record_extraction_only_moves_changed_at_on_change():
+    state = make_state(['a'], extracted_days=20)
+    old_changed_at = state['users']['a']['changed_at']
+
+    assert not record_extraction(state, 'a', ['music'], NOW.isoformat())
+    assert state['users']['a']['extracted_at'] == NOW.isoformat()
+    assert state['users']['a']['changed_at'] == old_changed_at
+
+    assert record_extraction(state, 'a', ['film'], NOW.isoformat())
+    assert state['users']['a']['changed_at'] == NOW.isoformat()
+
+
+def test_prune_state_drops_missing_users():
+    state = make_state(['a', 'b', 'c'])
+    state['pairs'] = {pair_key('a', 'b'): days_ago(1), pair_key('a', 'c'): days_ago(1)}
+
+    prune_state(state, {'a', 'b'})
+
+    assert set(state['users']) == {'a', 'b'}
+    assert set(state['pairs']) == {pair_key('a', 'b')}
+
+
+def test_state_round_trip(tmp_path):
+    path = str(tmp_path / 'state.json')
+    state = make_state(['a'])
+    state['pairs'][pair_key('a', 'b')] = days_ago(1)
+
+    scheduler.save_state(state, path)
+
+    assert scheduler.load_state(path) == state
+
+
+def test_load_state_missing_file(tmp_path):
+    assert scheduler.load_state(str(tmp_path / 'missing.json')) == {'users': {}, 'pairs': {}}
+
+
+# =============================================================================
+# Extraction planning
+# =============================================================================
+
+def test_needs_extraction():
+    state = make_state(['a'], extracted_days=5)
+
+    assert needs_extraction({'id': 'b'}, state)
+    assert needs_extraction({'id': 'a', 'last_post_at': days_ago(1)}, state)
+    assert not needs_extraction({'id': 'a', 'last_post_at': days_ago(10)}, state)
+
+
+def test_age_only_refresh_is_separate_from_extraction():
+    state = make_state(['old', 'fresh'], extracted_days=20)
+    state['users']['fresh']['extracted_at'] = days_ago(1)
+    users = make_users(['old', 'fresh', 'new'])
+
+    assert [u['id'] for u in plan_extractions(users, state, NOW)] == ['new']
+    assert [u['id'] for u in plan_refreshes(users, state, NOW)] == ['old']
+    assert not needs_refresh({'id': 'new'}, state, NOW)
+
+
+def test_plan_extractions_ranks_active_users_first():
+    users = [
+        {'id': 'dormant', 'posts': ['post'], 'last_post_at': days_ago(60)},
+        {'id': 'active', 'posts': ['post'], 'last_post_at': days_ago(0.1)},
+        {'id': 'new', 'posts': ['post'], 'created_at': days_ago(1)},
+        {'id': 'no_posts', 'posts': []},
+    ]
+
+    ranked = [u['id'] for u in plan_extractions(users, {'users': {}, 'pairs': {}}, NOW)]
+
+    assert ranked == ['new', 'active', 'dormant']
+
+
+# =============================================================================
+# Pair planning
+# =============================================================================
+
+def test_unchecked_pairs_are_due():
+    users = make_users(['a', 'b', 'c'])
+    state = make_state(['a', 'b', 'c'])
+
+    assert sorted(due_keys(users, state)) == sorted(
+        [pair_key('a', 'b'), pair_key('a', 'c'), pair_key('b', 'c')])
+
+
+def test_recently_checked_pair_is_not_due():
+    users = make_users(['a', 'b'])
+    state = make_state(['a', 'b'], extracted_days=5)
+    state['pairs'][pair_key('a', 'b')] = days_ago(1)
+
+    assert due_keys(users, state) == []
+
+
+def test_pair_due_after_interests_change():
+    users = make_users(['a', 'b'])
+    state = make_state(['a', 'b'], extracted_days=5)
+    state['pairs'][pair_key('a', 'b')] = days_ago(1)
+
+    record_extraction(state, 'a', ['film'], NOW.isoformat())
+
+    assert due_keys(users, state) == [pair_key('a', 'b')]
+
+
+def test_unchanged_reextraction_does_not_reopen_pairs():
+    ids = ['a', 'b', 'c', 'd', 'e']
+    users = make_users(ids)
+    state = make_state(ids, extracted_days=20)
+    for i, u1 in enumerate(ids):
+        for u2 in ids[i + 1:]:
+            state['pairs'][pair_key(u1, u2)] = days_ago(5)
+
+    record_extraction(state, 'a', ['music'], NOW.isoformat())
+
+    assert due_keys(users, state) == []
+
+
+def test_pair_due_once_stale():
+    users = make_users(['a', 'b'])
+    state = make_state(['a', 'b'], extracted_days=30)
+    state['pairs'][pair_key('a', 'b')] = days_ago(scheduler.MATCH_STALE_DAYS + 1)
+
+    assert due_keys(users, state) == [pair_key('a', 'b')]
+
+
+def test_fresh_match_row_keeps_stale_check_from_being_due():
+    users = make_users(['a', 'b'])
+    state = make_state(['a', 'b'], extracted_days=30)
+    key = pair_key('a', 'b')
+    state['pairs'][key] = days_ago(scheduler.MATCH_STALE_DAYS + 1)
+
+    assert due_keys(users, state, {key: days_ago(2)}) == []
+
+
+def test_stale_match_row_with_recent_check_is_not_due():
+    # A pair that stopped matching keeps its old row; the recent check wins
+    users = make_users(['a', 'b'])
+    state = make_state(['a', 'b'], extracted_days=30)
+    key = pair_key('a', 'b')
+    state['pairs'][key] = days_ago(1)
+
+    assert due_keys(users, state, {key: days_ago(60)}) == []
+
+
+def test_pairs_without_interests_are_skipped():
+    users = make_users(['a', 'b'])
+    users[1]['interests'] = []
+
+    assert due_keys(users, make_state(['a'])) == []
+
+
+def test_plan_pairs_ranks_active_users_first():
+    users = [
+        {'id': 'a', 'interests': ['music'], 'last_post_at': days_ago(0.1)},
+        {'id': 'b', 'interests': ['music'], 'last_post_at': days_ago(0.2)},
+        {'id': 'c', 'interests': ['music'], 'last_post_at': days_ago(60)},
+    ]
+
+    assert due_keys(users, make_state(['a', 'b', 'c']))[0] == pair_key('a', 'b')
+
+
+def test_plan_pairs_orders_ids_for_database_constraint():
+    users = make_users(['b', 'a'])
+
+    (user1, user2), = plan_pairs(users, make_state(['a', 'b']), {}, NOW)
+
+    assert user1['id'] < user2['id']